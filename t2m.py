@@ -11,9 +11,12 @@ import random
 import queue
 import logging
 import sys
+import socket
+import argparse
 from getpass import getpass
 
 import sc3.all as sc
+from sc3.base import _osclib as osclib
 import yaml
 import tweepy
 import spacy
@@ -62,6 +65,8 @@ class Config():
     search_wait_time: float
     tweet_dur: float
     credentials: str
+    nodes: List[str] = field(default_factory=list)  # 'host:port' entries.
+    net_latency: float = 3
 
 
 @dataclass
@@ -151,11 +156,12 @@ class FreesoundV2():
     logger = logging.getLogger('Freesound')
     NO_SOUNDS_EXIST = '<no sounds exist>'
 
-    def __init__(self):
+    def __init__(self, download=True):
         data = load_credentials('freesound_v2.yaml')
         self.client = freesound.FreesoundClient()
         self.client.set_token(data['api_key'])
         self.fields = 'id,name,previews,username,tags,images'
+        self.download = download  # False if sounds are played elsewhere.
         self.search_cache = dict()  # {word: results}
         self.sound_cache = dict()  # {id: file_name}
 
@@ -181,21 +187,32 @@ class FreesoundV2():
             sound = freesound.Sound(random.choice(results.results), self.client)
             id = sound.id
 
-            if id in self.sound_cache:
-                file_name = self.sound_cache[id]
-                path = str(Path(SOUNDS_FOLDER) / Path(str(id) + '.wav'))
-            else:
-                file_name = str(id) + '.mp3'
-                sound.retrieve_preview(SOUNDS_FOLDER, file_name)
-                p1 = str(Path(SOUNDS_FOLDER) / Path(file_name))
-                p2 = str(Path(SOUNDS_FOLDER) / Path(str(id) + '.wav'))
-                ffmpeg.input(p1).output(p2).run(quiet=True, overwrite_output=True)
-                self.sound_cache[id] = file_name
-                path = p2
+            if self.download and id not in self.sound_cache:
+                self._retrieve(sound)
+            path = self.sound_path(id) if self.download else ''
 
             word.sound = Sound(
                 id=id, path=path, file_name=sound.name, user=sound.username)
-            self.logger.info("%s sound selected for '%s'", path, word.text)
+            self.logger.info("%s sound selected for '%s'", path or id, word.text)
+
+    def fetch(self, id: int) -> str:
+        if id not in self.sound_cache:
+            sound = self.client.get_sound(id, fields=self.fields)
+            self._retrieve(sound)
+            self.logger.info('%s sound prefetched', id)
+        return self.sound_path(id)
+
+    def _retrieve(self, sound):
+        file_name = str(sound.id) + '.mp3'
+        sound.retrieve_preview(SOUNDS_FOLDER, file_name)
+        p1 = str(Path(SOUNDS_FOLDER) / Path(file_name))
+        p2 = self.sound_path(sound.id)
+        ffmpeg.input(p1).output(p2).run(quiet=True, overwrite_output=True)
+        self.sound_cache[sound.id] = file_name
+
+    @staticmethod
+    def sound_path(id):
+        return str(Path(SOUNDS_FOLDER) / Path(str(id) + '.wav'))
 
 
 class T2M():
@@ -204,8 +221,9 @@ class T2M():
     def __init__(self, scheduler, config):
         self._thread = None
         self._thread_running = False
+        self._stop_event = threading.Event()
         self.twitter = TwitterV1()
-        self.freesound = FreesoundV2()
+        self.freesound = FreesoundV2(download=not config.nodes)
         self.analysis = Analysis()
         self.scheduler = scheduler
         self.config = config
@@ -213,11 +231,13 @@ class T2M():
     def start(self):
         self._thread = threading.Thread(target=self._run, daemon=True)
         self._thread_running = True
+        self._stop_event.clear()
         self._thread.start()
 
     def _run(self):
         while self._thread_running:
-            time.sleep(self.config.search_wait_time)
+            if self._stop_event.wait(self.config.search_wait_time):
+                return
             try:
                 self.logger.info(f'searching tweets for {self.config.hashtag}...')
                 # Get new tweets.
@@ -246,6 +266,7 @@ class T2M():
     def stop(self):
         if self._thread is not None:
             self._thread_running = False
+            self._stop_event.set()
             self._thread.join()
 
 
@@ -435,7 +456,10 @@ class _ViewPlayer(QtCore.QObject):
         if self.timer is None:
             return
 
-        text = word.text + ' : ' + Path(word.sound.file_name).stem + ' | ' + word.sound.user
+        if word.sound:
+            text = word.text + ' : ' + Path(word.sound.file_name).stem + ' | ' + word.sound.user
+        else:
+            text = word.text
 
         word_item = QtWidgets.QGraphicsTextItem(text, self.text_background)
         word_item.setPos(self.next_line_pos)
@@ -556,36 +580,239 @@ class SoundPlayer():
         sc.SynthDef(cls.def_prefix + str(channels), func).add()
 
 
+class LocalOutput():
+    def __init__(self):
+        self._tweet_player = None
+
+    def prefetch(self, tweet):
+        pass
+
+    def play_tweet(self, id, text, dur):
+        self._tweet_player = TweetPlayer(text, dur)
+        self._tweet_player.play()
+
+    def play_word(self, id, word, dur):
+        self._tweet_player.play_word(word, dur)
+        if word.sound:
+            SoundPlayer(word, dur=dur).play()
+
+
+class NetOutput():
+    logger = logging.getLogger('NetOutput')
+
+    def __init__(self, nodes, latency):
+        self.nodes = []
+        for node in nodes:
+            try:
+                hostname, port = node.split(':')
+                addr = (socket.gethostbyname(hostname), int(port))
+            except (ValueError, OSError) as e:
+                raise ValueError(f"invalid nodes entry '{node}': {e}") from e
+            self.nodes.append(addr)
+        self.latency = latency
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def _send_all(self, dgram):
+        for node in self.nodes:
+            try:
+                self._socket.sendto(dgram, node)
+            except Exception as e:
+                self.logger.error('%s: %s: %s', node, type(e).__qualname__, e)
+
+    @staticmethod
+    def _build_msg(path, *args):
+        builder = osclib.OscMessageBuilder(path)
+        for arg in args:
+            builder.add_arg(arg)
+        return builder.build()
+
+    def _send(self, *msg):
+        # Timestamped, nodes play the events latency seconds from now.
+        # Physical time, logical time is not updated in this thread.
+        time = sc.main.elapsed_time() + self.latency
+        builder = osclib.OscBundleBuilder(sc.SystemClock.elapsed_time_to_osc(time))
+        builder.add_content(self._build_msg(*msg))
+        self._send_all(builder.build().dgram)
+
+    def prefetch(self, tweet):
+        for word in tweet.words:
+            if word.sound:
+                self._send_all(
+                    self._build_msg('/t2m/prefetch', word.sound.id).dgram)
+
+    def play_tweet(self, id, text, dur):
+        self._send('/t2m/tweet', id, text, float(dur))
+
+    def play_word(self, id, word, dur):
+        if word.sound:
+            self._send(
+                '/t2m/word', id, word.text, float(dur),
+                word.sound.id, word.sound.file_name, word.sound.user)
+        else:
+            self._send('/t2m/word', id, word.text, float(dur))
+
+
+class Node():
+    logger = logging.getLogger('Node')
+
+    def __init__(self, port):
+        self._wait_time = 0.5
+        self._thread = None
+        self._recv_thread = None
+        self._thread_running = False
+        self._socket = None
+        self._handlers = {
+            '/t2m/prefetch': self._recv_prefetch,
+            '/t2m/tweet': self._recv_tweet,
+            '/t2m/word': self._recv_word}
+        # Tweets are sequential, only the last one receives words.
+        self._tweet_id = None
+        self._tweet_player = None
+        self._pending = dict()  # {sound_id: (word, end_time)}
+        self.port = port
+        self.freesound = FreesoundV2()
+        self.fetch_queue = queue.Queue()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread_running = True
+        self._thread.start()
+
+        # sc3 only binds its ports to localhost, nodes receive from any host.
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.settimeout(self._wait_time)
+        self._socket.bind(('0.0.0.0', self.port))
+        self._recv_thread = threading.Thread(target=self._recv, daemon=True)
+        self._recv_thread.start()
+        self.logger.info('listening on port %i', self.port)
+
+    def _recv(self):
+        while self._thread_running:
+            try:
+                data, _ = self._socket.recvfrom(65536)
+            except socket.timeout:
+                continue
+            try:
+                for timed_msg in osclib.OscPacket(data).messages:
+                    if timed_msg.time in (None, osclib.IMMEDIATELY):
+                        time = sc.main.elapsed_time()
+                    else:
+                        time = sc.SystemClock.osc_to_elapsed_time(timed_msg.time)
+                    msg = timed_msg.message
+                    handler = self._handlers.get(msg.address)
+                    if handler is not None:
+                        handler([msg.address, *msg.params], time)
+            except Exception as e:
+                self.logger.error('%s: %s', type(e).__qualname__, e)
+
+    def _run(self):
+        while self._thread_running:
+            id = self.fetch_queue.get()
+            if id is None:
+                return
+            try:
+                self.freesound.fetch(id)
+                self._play_pending(id)
+            except Exception as e:
+                self.logger.error('%s: %s', type(e).__qualname__, e)
+
+    def _recv_prefetch(self, msg, time):
+        self.fetch_queue.put(msg[1])
+
+    def _recv_tweet(self, msg, time):
+        _, id, text, dur = msg
+
+        def action():
+            self._tweet_id = id
+            self._tweet_player = TweetPlayer(text, dur)
+            self._tweet_player.play()
+
+        sc.SystemClock.sched_abs(time, action)
+
+    def _recv_word(self, msg, time):
+        id, text, dur, *sound = msg[1:]
+        word = Word(text=text, index=0)
+
+        def action():
+            if id != self._tweet_id:
+                return
+            if sound:
+                sound_id, file_name, user = sound
+                word.sound = Sound(
+                    id=sound_id, path=self.freesound.sound_path(sound_id),
+                    file_name=file_name, user=user)
+            self._tweet_player.play_word(word, dur)
+            if not word.sound:
+                return
+            # Late sounds play when fetched if the word is still shown.
+            self._pending[word.sound.id] = (word, time + dur)
+            if word.sound.id in self.freesound.sound_cache:
+                self._play_pending(word.sound.id)
+            else:
+                self.logger.info('%s sound not prefetched yet', word.sound.id)
+                self.fetch_queue.put(word.sound.id)
+
+        sc.SystemClock.sched_abs(time, action)
+
+    def _play_pending(self, sound_id):
+        # Either the word action or the fetch thread plays it, pop is atomic.
+        pending = self._pending.pop(sound_id, None)
+        if pending is None:
+            return
+        word, end_time = pending
+        player = SoundPlayer(word, dur=end_time - sc.main.elapsed_time())
+        if player.dur > player.fadein + player.fadeout:
+            player.play()
+
+    def stop(self):
+        if self._thread is not None:
+            self._thread_running = False
+            self.fetch_queue.put(None)
+            self._thread.join()
+            self._recv_thread.join()
+            self._socket.close()
+
+
 class Scheduler():
-    def __init__(self, config):
+    def __init__(self, config, output):
         self._wait_time = 0.5
         self._thread = None
         self._thread_running = False
+        self._stop_event = threading.Event()
+        self._tweet_id = 0
         self.config = config
+        self.output = output
         self.queue = queue.Queue()
 
     def add_tweet(self, tweet):
+        self.output.prefetch(tweet)
         self.queue.put(tweet)
 
     def start(self):
         self._thread = threading.Thread(target=self._run, daemon=True)
         self._thread_running = True
+        self._stop_event.clear()
         self._thread.start()
 
     def _run(self):
         while self._thread_running:
             while self.queue.empty():
-                time.sleep(self._wait_time)
+                if self._stop_event.wait(self._wait_time):
+                    return
 
             while not self.queue.empty():
                 tweet_dur = self.config.tweet_dur
                 tweet = self.queue.get()
                 words = [w for w in tweet.words if w.sound]
+                # Sequential id, tweet ids don't fit in OSC int32.
+                id = self._tweet_id
+                self._tweet_id += 1
+                # Prefetch is idempotent, resend for lost or late nodes.
+                self.output.prefetch(tweet)
 
                 if words:
                     # Show tweet text.
-                    tweet_player = TweetPlayer(tweet.user + ' | ' + tweet.text, tweet_dur)
-                    tweet_player.play()
+                    self.output.play_tweet(id, tweet.user + ' | ' + tweet.text, tweet_dur)
 
                     n_words = len(words)
                     hop_dur = tweet_dur / n_words / 2
@@ -593,25 +820,28 @@ class Scheduler():
 
                     for word in words:
                         # text, index, sound
-                        # Show selected word.
-                        tweet_player.play_word(word, word_dur)
-                        # Play word sound.
-                        SoundPlayer(word, dur=word_dur).play()
+                        # Show selected word and play word sound.
+                        self.output.play_word(id, word, word_dur)
                         # Wait time between words.
-                        time.sleep(hop_dur)
+                        if self._stop_event.wait(hop_dur):
+                            return
 
-                    time.sleep(tweet_dur - hop_dur * n_words)
+                    if self._stop_event.wait(tweet_dur - hop_dur * n_words):
+                        return
                 else:
                     tweet_dur = 10  # Silent tweet.
                     # Show tweet text.
-                    tweet_player = TweetPlayer(tweet.user + ' | ' + tweet.text, tweet_dur)
-                    tweet_player.play()
-                    tweet_player.play_word('No sounds found for this tweet', tweet_dur)
-                    time.sleep(tweet_dur)
+                    self.output.play_tweet(id, tweet.user + ' | ' + tweet.text, tweet_dur)
+                    self.output.play_word(
+                        id, Word(text='No sounds found for this tweet', index=0),
+                        tweet_dur)
+                    if self._stop_event.wait(tweet_dur):
+                        return
 
     def stop(self):
         if self._thread is not None:
             self._thread_running = False
+            self._stop_event.set()
             self._thread.join()
 
 
@@ -631,30 +861,67 @@ def load_credentials(file_name):
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tweets to music.')
+    parser.add_argument(
+        '--node', type=int, metavar='PORT',
+        help='run as a render node receiving events on PORT')
+    parser.add_argument(
+        '--server-port', type=int, metavar='PORT',
+        help='SuperCollider server port for this instance (default: 57110)')
+    args, qt_args = parser.parse_known_args()
+
     config = load_config()
     CREDENTIALS_FILE = config.credentials
     PASSWORD = getpass()
-    SOUNDS_FOLDER = Path(tempfile.gettempdir()) / 't2m_sounds'
+    if args.node is None:
+        SOUNDS_FOLDER = Path(tempfile.gettempdir()) / 't2m_sounds'
+    else:
+        SOUNDS_FOLDER = Path(tempfile.gettempdir()) / f't2m_sounds_{args.node}'
     if not SOUNDS_FOLDER.exists():
         SOUNDS_FOLDER.mkdir()
 
-    # Init SuperCollider.
-    sc.s.boot()
-    SoundPlayer.build_def(1)
-    SoundPlayer.build_def(2)
-
-    # Init Qt.
-    app = QtWidgets.QApplication(sys.argv)
-    view = View()
-
-    # Init Scheduler.
-    scheduler = Scheduler(config)
-    scheduler.start()
+    # Events are only sent to render nodes, no local view or sound.
+    headless = args.node is None and bool(config.nodes)
 
-    # Init T2M
-    t2m = T2M(scheduler, config)
-    t2m.start()
+    if headless:
+        if args.server_port is not None:
+            T2M.logger.warning('--server-port ignored, no local sound server')
+    else:
+        # Init SuperCollider.
+        if args.server_port is not None and args.server_port != sc.s.addr.port:
+            sc.s.addr = sc.NetAddr('127.0.0.1', args.server_port)
+        sc.s.boot()
+        SoundPlayer.build_def(1)
+        SoundPlayer.build_def(2)
+
+        # Init Qt.
+        app = QtWidgets.QApplication(sys.argv[:1] + qt_args)
+        view = View()
+
+    if args.node is None:
+        # Init Scheduler.
+        if config.nodes:
+            output = NetOutput(config.nodes, config.net_latency)
+        else:
+            output = LocalOutput()
+        scheduler = Scheduler(config, output)
+        scheduler.start()
 
-    # Start Qt App.
-    view.show()
-    sys.exit(app.exec_())
+        # Init T2M
+        t2m = T2M(scheduler, config)
+        t2m.start()
+    else:
+        # Init Node, events are received from the scheduler.
+        node = Node(args.node)
+        node.start()
+
+    if headless:
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            scheduler.stop()
+            t2m.stop()
+    else:
+        # Start Qt App.
+        view.show()
+        sys.exit(app.exec_())